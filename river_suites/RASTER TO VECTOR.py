@@ -1,5 +1,6 @@
 import os
 import glob
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import geopandas as gpd
 import rasterio
 from rasterio import features
@@ -18,6 +19,89 @@ PADDING = 100.0  # Margen de seguridad (metros) para que el río no toque el bor
 # =============================================================================
 # SCRIPT DE CONVERSIÓN
 # =============================================================================
+# Buffer de rasterización reutilizado por proceso: mientras los años
+# compartan dimensiones se limpia con fill(0) en vez de reasignar
+_BUF = None
+
+
+def _get_buf(height, width):
+    global _BUF
+    if _BUF is None or _BUF.shape != (height, width):
+        _BUF = np.zeros((height, width), dtype=np.uint8)
+    else:
+        _BUF.fill(0)
+    return _BUF
+
+
+def _procesar_un_shp(ruta_shp, output_folder):
+    """
+    Rasteriza un shapefile a binario de 30 m y escribe su GeoTIFF.
+    Función de módulo (picklable) para poder despacharla a procesos.
+    """
+    nombre_archivo = os.path.basename(ruta_shp).replace(".shp", "")
+
+    # 1. Cargar Vector
+    gdf = gpd.read_file(ruta_shp)
+    if gdf.empty:
+        return nombre_archivo
+
+    # 2. Calcular Dimensiones (Bounds + Padding)
+    # Ajuste al borde del píxel en una sola expresión: floor en los mínimos,
+    # ceil en los máximos, todo sobre la grilla global de 30 m — así los
+    # rasters de distintos años quedan alineados byte a byte sin remuestreo
+    bounds = np.asarray(gdf.total_bounds)
+    redondeo = np.concatenate([np.floor(bounds[:2] / PIXEL_SIZE),
+                               np.ceil(bounds[2:] / PIXEL_SIZE)])
+    # El margen también se redondea a píxeles completos (>= PADDING) para no
+    # sacar la grilla de fase
+    pad = np.ceil(PADDING / PIXEL_SIZE) * PIXEL_SIZE
+    minx, miny, maxx, maxy = (redondeo * PIXEL_SIZE
+                              + np.array([-pad, -pad, pad, pad]))
+
+    # La alineación entera de la grilla es lo que garantiza que los años
+    # comparen píxel a píxel aguas abajo
+    assert (maxx - minx) % PIXEL_SIZE == 0
+    assert (maxy - miny) % PIXEL_SIZE == 0
+
+    width = int((maxx - minx) / PIXEL_SIZE)
+    height = int((maxy - miny) / PIXEL_SIZE)
+
+    # 3. Transformación
+    transform = from_origin(minx, maxy, PIXEL_SIZE, PIXEL_SIZE)
+
+    # 4. Rasterizar (Quemar geometría)
+    # all_touched=True es CRÍTICO en 30m para no romper la continuidad del río
+    # Los pares (geom, valor) salen del arreglo de geometrías y un ones()
+    # precalculado, sin el generador Python por geometría
+    geoms = gdf.geometry.values
+    valores = np.ones(len(geoms), dtype=np.uint8)
+    imagen = _get_buf(height, width)
+    features.rasterize(
+        shapes=zip(geoms, valores),
+        out=imagen,  # 0 = Fondo, 1 = Río (buffer ya en ceros)
+        transform=transform,
+        all_touched=True
+    )
+
+    # 5. Guardar TIFF Binario
+    # Teselado 512x512 + DEFLATE con predictor: comprime mejor que LZW en
+    # máscaras binarias y GDAL paraleliza el encode entre hilos
+    ruta_salida = os.path.join(output_folder, f"{nombre_archivo}_30m.tif")
+
+    with rasterio.Env(GDAL_CACHEMAX=512, GDAL_NUM_THREADS='ALL_CPUS'):
+        with rasterio.open(
+                ruta_salida, 'w', driver='GTiff',
+                height=height, width=width, count=1,
+                dtype=rasterio.uint8, crs=gdf.crs, transform=transform,
+                compress='deflate', predictor=2,
+                tiled=True, blockxsize=512, blockysize=512,
+                num_threads='ALL_CPUS', BIGTIFF='IF_SAFER'
+        ) as dst:
+            dst.write(imagen, 1)
+
+    return nombre_archivo
+
+
 def convertir_shp_a_binario_30m():
     if not os.path.exists(OUTPUT_FOLDER):
         os.makedirs(OUTPUT_FOLDER)
@@ -27,56 +111,19 @@ def convertir_shp_a_binario_30m():
     print(f"--- INICIANDO CONVERSIÓN ESTRICTA (30m) ---")
     print(f"Archivos encontrados: {len(archivos_shp)}")
 
-    for i, ruta_shp in enumerate(archivos_shp):
-        nombre_archivo = os.path.basename(ruta_shp).replace(".shp", "")
-        print(f"[{i + 1}/{len(archivos_shp)}] Procesando: {nombre_archivo}...")
-
-        try:
-            # 1. Cargar Vector
-            gdf = gpd.read_file(ruta_shp)
-            if gdf.empty: continue
-
-            # 2. Calcular Dimensiones (Bounds + Padding)
-            minx, miny, maxx, maxy = gdf.total_bounds
-
-            # Ajustar al borde del píxel más cercano para evitar desplazamientos (sub-pixel shifts)
-            minx = np.floor(minx / PIXEL_SIZE) * PIXEL_SIZE - PADDING
-            maxy = np.ceil(maxy / PIXEL_SIZE) * PIXEL_SIZE + PADDING
-            maxx = np.ceil(maxx / PIXEL_SIZE) * PIXEL_SIZE + PADDING
-            miny = np.floor(miny / PIXEL_SIZE) * PIXEL_SIZE - PADDING
-
-            width = int((maxx - minx) / PIXEL_SIZE)
-            height = int((maxy - miny) / PIXEL_SIZE)
-
-            # 3. Transformación
-            transform = from_origin(minx, maxy, PIXEL_SIZE, PIXEL_SIZE)
-
-            # 4. Rasterizar (Quemar geometría)
-            # all_touched=True es CRÍTICO en 30m para no romper la continuidad del río
-            shapes = ((geom, 1) for geom in gdf.geometry)
-            imagen = features.rasterize(
-                shapes=shapes,
-                out_shape=(height, width),
-                transform=transform,
-                fill=0,  # 0 = Fondo
-                default_value=1,  # 1 = Río
-                dtype=rasterio.uint8,
-                all_touched=True
-            )
-
-            # 5. Guardar TIFF Binario
-            ruta_salida = os.path.join(OUTPUT_FOLDER, f"{nombre_archivo}_30m.tif")
-
-            with rasterio.open(
-                    ruta_salida, 'w', driver='GTiff',
-                    height=height, width=width, count=1,
-                    dtype=rasterio.uint8, crs=gdf.crs, transform=transform,
-                    compress='lzw'
-            ) as dst:
-                dst.write(imagen, 1)
-
-        except Exception as e:
-            print(f"Error en {nombre_archivo}: {e}")
+    # Cada shapefile es independiente (leer -> rasterizar -> comprimir), así
+    # que el lote se reparte entre procesos; el avance se reporta conforme
+    # cada archivo termina
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as ex:
+        futuros = {ex.submit(_procesar_un_shp, ruta, OUTPUT_FOLDER): ruta
+                   for ruta in archivos_shp}
+        for i, futuro in enumerate(as_completed(futuros)):
+            nombre = os.path.basename(futuros[futuro]).replace(".shp", "")
+            try:
+                futuro.result()
+                print(f"[{i + 1}/{len(archivos_shp)}] Listo: {nombre}")
+            except Exception as e:
+                print(f"Error en {nombre}: {e}")
 
     print("\n--- PROCESO TERMINADO ---")
     print("Nota: Al ser 30m, los bordes se verán 'pixelados' en ArcScan.")
@@ -11,6 +11,52 @@ from PyQt5.QtCore import Qt
 
 YEAR_RE = re.compile(r"(19\d{2}|20\d{2})")
 
+# CRS UTM cacheados por (zona, hemisferio): los rasters vecinos casi siempre
+# caen en la misma zona, así que la consulta a la base de PROJ se hace una vez
+_UTM_CACHE = {}
+
+
+def _utm_for(gdf):
+    """
+    CRS UTM del frame derivado del centroide (zona + hemisferio), con caché a
+    nivel de módulo — reemplaza el estimate_utm_crs por archivo, que repite
+    la búsqueda de área de uso de pyproj en cada llamada.
+    """
+    from pyproj import CRS, Transformer
+
+    minx, miny, maxx, maxy = gdf.total_bounds
+    cx, cy = (minx + maxx) / 2.0, (miny + maxy) / 2.0
+    if gdf.crs is not None and not gdf.crs.is_geographic:
+        tr = Transformer.from_crs(gdf.crs, "EPSG:4326", always_xy=True)
+        cx, cy = tr.transform(cx, cy)
+
+    zona = int((cx + 180.0) // 6.0) + 1
+    clave = (zona, cy >= 0.0)
+    if clave not in _UTM_CACHE:
+        _UTM_CACHE[clave] = CRS.from_epsg((32600 if cy >= 0.0 else 32700) + zona)
+    return _UTM_CACHE[clave]
+
+
+def _fast_to_crs(gdf, dst_crs):
+    """
+    Reproyección por lote: aplana todas las coordenadas del frame con
+    get_coordinates, las pasa por un solo pyproj.Transformer y las reinyecta
+    con set_coordinates — una llamada C sobre un arreglo (N,2) contiguo en
+    vez del recorrido geometría a geometría de to_crs.
+    """
+    import numpy as np
+    import shapely
+    from pyproj import Transformer
+
+    if gdf.crs == dst_crs:
+        return gdf
+    tr = Transformer.from_crs(gdf.crs, dst_crs, always_xy=True)
+    geoms = gdf.geometry.values.to_numpy().copy()
+    coords = shapely.get_coordinates(geoms)
+    nx, ny = tr.transform(coords[:, 0], coords[:, 1])
+    nuevos = shapely.set_coordinates(geoms, np.column_stack([nx, ny]))
+    return gdf.set_geometry(nuevos, crs=dst_crs)
+
 
 class RasterVectorFusionApp(QWidget):
     def __init__(self):
@@ -60,10 +106,12 @@ class RasterVectorFusionApp(QWidget):
     def vectorizar_por_ano(self):
         # imports locales (evitan cargar GDAL/Fiona en el arranque)
         try:
+            import numpy as np
             import rasterio
             from rasterio.features import shapes
+            from rasterio.windows import transform as window_transform
             import geopandas as gpd
-            from shapely.geometry import shape
+            import shapely
         except Exception as e:
             QMessageBox.critical(self, "Error importación",
                                  f"No se pudieron importar librerías necesarias:\n{e}")
@@ -90,42 +138,55 @@ class RasterVectorFusionApp(QWidget):
 
             try:
                 with rasterio.open(file) as src:
-                    arr = src.read(1)
-                    mask = arr == 1
-                    results = (
-                        {"properties": {"value": int(v)}, "geometry": s}
-                        for s, v in shapes(arr, mask=mask, transform=src.transform)
+                    # Polygonización por bloques internos del raster: la
+                    # memoria queda O(bloque) en vez de O(banda completa)
+                    rasgos = []
+                    for _, window in src.block_windows(1):
+                        arr = src.read(1, window=window)
+                        mask = arr == 1
+                        if not mask.any():
+                            continue
+                        tr_win = window_transform(window, src.transform)
+                        # from_features (abajo) consume los dicts GeoJSON
+                        # directamente, sin el factory shape() por feature
+                        rasgos.extend(s for s, v in shapes(arr, mask=mask, transform=tr_win)
+                                      if int(v) == 1)
+
+                    gdf = gpd.GeoDataFrame.from_features(
+                        ({"geometry": s, "properties": {}} for s in rasgos),
+                        crs=src.crs
                     )
 
-                    geoms = [shape(feat["geometry"]) for feat in results if int(feat["properties"]["value"]) == 1]
-
-                    if not geoms:
+                    if gdf.empty:
                         self.log_append(f"  [{idx}] {base}: sin geometrías (no se detectó valor 1).")
                         continue
 
-                    gdf = gpd.GeoDataFrame(geometry=geoms, crs=src.crs)
-
-                    # reproyectar a UTM detectado (estimate_utm_crs)
+                    # Re-unir los polígonos partidos por los bordes de bloque:
+                    # solo los que tocan a otro entran al union_all; get_parts
+                    # separa de vuelta los grupos fusionados
+                    geoms = gdf.geometry.values.to_numpy()
+                    arbol = shapely.STRtree(geoms)
+                    a, b = arbol.query(geoms, predicate='intersects')
+                    tocan = np.zeros(len(geoms), dtype=bool)
+                    tocan[a[a != b]] = True
+                    if tocan.any():
+                        fusionadas = shapely.get_parts(shapely.union_all(geoms[tocan]))
+                        geoms = np.concatenate([geoms[~tocan], fusionadas])
+                        gdf = gpd.GeoDataFrame(geometry=geoms, crs=src.crs)
+
+                    # reproyectar a UTM detectado (zona cacheada por centroide)
                     try:
-                        utm = gdf.estimate_utm_crs()
-                        gdf = gdf.to_crs(utm)
+                        utm = _utm_for(gdf)
+                        gdf = _fast_to_crs(gdf, utm)
                     except Exception as e:
                         self.log_append(f"  [{idx}] {base}: advertencia reproyección UTM: {e} (se guardará en CRS original).")
 
                     nombre_salida = f"VECT_{os.path.splitext(base)[0]}.shp"
                     ruta_salida = os.path.join(carpeta_anio, nombre_salida)
 
-                    # eliminar previos si existen
-                    base_noext = os.path.splitext(ruta_salida)[0]
-                    for ext in [".shp", ".shx", ".dbf", ".prj", ".cpg"]:
-                        p = base_noext + ext
-                        if os.path.exists(p):
-                            try:
-                                os.remove(p)
-                            except Exception:
-                                pass
-
-                    gdf.to_file(ruta_salida)
+                    # pyogrio escribe en un solo recorrido C y sobrescribe
+                    # salidas previas, así que sobra el borrado por extensión
+                    gdf.to_file(ruta_salida, engine='pyogrio')
                     self.log_append(f"  [{idx}] {base} → Guardado: {ruta_salida} (geoms: {len(gdf)})")
 
             except Exception as e:
@@ -139,8 +200,10 @@ class RasterVectorFusionApp(QWidget):
     def fusionar_por_ano(self):
         # imports locales
         try:
+            import numpy as np
             import geopandas as gpd
-            from shapely.ops import unary_union
+            import pyogrio
+            import shapely
         except Exception as e:
             QMessageBox.critical(self, "Error importación",
                                  f"No se pudieron importar librerías necesarias:\n{e}")
@@ -179,12 +242,20 @@ class RasterVectorFusionApp(QWidget):
 
             self.log_append(f"  - {entry}: {len(shp_files)} shapefiles encontrados. → leyendo y uniendo...")
 
-            geoms = []
+            # Unión parcial por shapefile (acota memoria: cada archivo se
+            # disuelve apenas se lee y se descarta); las piezas resultantes
+            # se unen después por componentes conexas
+            parciales = []
             target_crs = None
-            # leer uno por uno y extraer geometrías (liberando memoria)
             for shp in shp_files:
                 try:
-                    gdf = gpd.read_file(shp)
+                    # Chequeo de vacío desde el header (sin abrir features) y
+                    # lectura de solo geometría: el DBF de atributos no se
+                    # necesita para la fusión
+                    if pyogrio.read_info(shp).get("features") == 0:
+                        self.log_append(f"    • {os.path.basename(shp)}: vacío → omitido")
+                        continue
+                    gdf = pyogrio.read_dataframe(shp, columns=[])
                     if gdf.empty:
                         self.log_append(f"    • {os.path.basename(shp)}: vacío → omitido")
                         continue
@@ -196,51 +267,77 @@ class RasterVectorFusionApp(QWidget):
                     # reproyectar al CRS objetivo si difiere
                     if gdf.crs != target_crs:
                         try:
-                            gdf = gdf.to_crs(target_crs)
+                            gdf = _fast_to_crs(gdf, target_crs)
                         except Exception as e:
                             self.log_append(f"    • {os.path.basename(shp)}: fallo reproyección a target_crs: {e} → se omitirá este shapefile")
                             continue
 
-                    # añadir geometrías válidas
-                    for geom in gdf.geometry:
-                        if geom is None or geom.is_empty:
-                            continue
-                        geoms.append(geom)
+                    geoms = gdf.geometry.values.to_numpy()
+                    geoms = geoms[geoms != None]  # noqa: E711 — comparación elemento a elemento
+                    geoms = geoms[~shapely.is_empty(geoms)]
+                    if geoms.size:
+                        parciales.append(shapely.union_all(geoms))
 
                     # liberar
-                    del gdf
+                    del gdf, geoms
 
                 except Exception as e:
                     self.log_append(f"    ❌ Error leyendo {os.path.basename(shp)}: {e}")
                     continue
 
-            if not geoms:
+            if not parciales:
                 self.log_append(f"    ⚠ No se encontraron geometrías válidas en {entry} → omitiendo.")
                 continue
 
-            # realizar la unión topológica (unary_union)
             try:
-                unioned = unary_union(geoms)
-                if unioned.is_empty:
+                # Unión final por componentes conexas: el STRtree detecta qué
+                # uniones parciales se tocan y solo esas pasan juntas por
+                # union_all — las poblaciones disjuntas no pagan chequeos
+                # topológicos entre sí
+                piezas = np.array(parciales, dtype=object)
+                piezas = piezas[~shapely.is_empty(piezas)]
+                if piezas.size == 0:
                     self.log_append(f"    ⚠ Unión vacía para {entry}, se omite.")
                     continue
 
-                # normalizar a lista de polígonos/multipolígonos
-                parts = []
-                if unioned.geom_type == "Polygon":
-                    parts = [unioned]
-                elif unioned.geom_type == "MultiPolygon":
-                    parts = list(unioned.geoms)
-                else:
-                    # GeometryCollection u otros -> extraer polígonos
-                    for g in getattr(unioned, "geoms", [unioned]):
-                        if g.geom_type in ("Polygon", "MultiPolygon"):
-                            if g.geom_type == "Polygon":
-                                parts.append(g)
-                            else:
-                                parts.extend(list(g.geoms))
-
-                if not parts:
+                arbol = shapely.STRtree(piezas)
+                a, b = arbol.query(piezas, predicate='intersects')
+
+                # union-find sobre los pares para etiquetar componentes
+                padre = np.arange(piezas.size)
+
+                def _raiz(i):
+                    while padre[i] != i:
+                        padre[i] = padre[padre[i]]
+                        i = padre[i]
+                    return i
+
+                for i, j in zip(a, b):
+                    ri, rj = _raiz(i), _raiz(j)
+                    if ri != rj:
+                        padre[rj] = ri
+
+                etiquetas = np.array([_raiz(i) for i in range(piezas.size)])
+                unidas = np.array(
+                    [shapely.union_all(piezas[etiquetas == e])
+                     for e in np.unique(etiquetas)],
+                    dtype=object
+                )
+
+                # normalizar a polígonos: get_parts aplana cada componente
+                # (Polygon/MultiPolygon/GeometryCollection) en C y el filtro
+                # por tipo es una máscara vectorizada (type_id 3 = Polygon)
+                parts = shapely.get_parts(unidas)
+                tipos = shapely.get_type_id(parts)
+                if (tipos == 6).any():
+                    # MultiPolygon anidado en GeometryCollection: un segundo
+                    # aplanado lo reduce a polígonos simples
+                    parts = np.concatenate([parts[tipos == 3],
+                                            shapely.get_parts(parts[tipos == 6])])
+                    tipos = shapely.get_type_id(parts)
+                parts = parts[tipos == 3]
+
+                if parts.size == 0:
                     self.log_append(f"    ⚠ Después de procesar, no hay polígonos en {entry}.")
                     continue
 
@@ -255,17 +352,9 @@ class RasterVectorFusionApp(QWidget):
                 out_name = f"{river_name}_{entry}.shp"
                 out_path = os.path.join(salida_base, out_name)
 
-                # eliminar previos si existen
-                base_noext = os.path.splitext(out_path)[0]
-                for ext in [".shp", ".shx", ".dbf", ".prj", ".cpg"]:
-                    p = base_noext + ext
-                    if os.path.exists(p):
-                        try:
-                            os.remove(p)
-                        except Exception:
-                            pass
-
-                out_gdf.to_file(out_path)
+                # pyogrio sobrescribe shapefiles existentes, así que el
+                # borrado por extensión (hasta 10 syscalls por archivo) sobra
+                out_gdf.to_file(out_path, engine='pyogrio')
                 self.log_append(f"    ✅ Guardado fusionado: {out_path} (partes: {len(parts)})")
 
             except Exception as e:
@@ -0,0 +1,49 @@
+"""
+Kernels numéricos compilados (numba) para el suavizado B-spline.
+
+numba es una dependencia opcional: este módulo importa numba directamente y,
+si no está instalado, el ImportError se propaga para que el script llamador
+siga evaluando con scipy.splev.
+"""
+import numpy as np
+from numba import njit, prange
+
+
+@njit(cache=True, parallel=True, fastmath=True)
+def deboor_eval(t, cx, cy, k, u):
+    """
+    Evalúa la B-spline (nudos t, coeficientes cx/cy, grado k) en todos los
+    parámetros `u` con el algoritmo de de Boor: sin el setup Python/Fortran
+    de splev por llamada y con el bucle de estaciones paralelizado.
+    """
+    n = u.size
+    n_coef = cx.size
+    out_x = np.empty(n, dtype=np.float64)
+    out_y = np.empty(n, dtype=np.float64)
+    for i in prange(n):
+        x = u[i]
+        # Tramo de nudos que contiene a x: t[j] <= x < t[j+1]
+        j = np.searchsorted(t, x, side='right') - 1
+        if j < k:
+            j = k
+        if j > n_coef - 1:
+            j = n_coef - 1
+
+        dx = cx[j - k:j + 1].copy()
+        dy = cy[j - k:j + 1].copy()
+        for r in range(1, k + 1):
+            for s in range(k, r - 1, -1):
+                den = t[j + s - r + 1] - t[j + s - k]
+                alpha = (x - t[j + s - k]) / den if den != 0.0 else 0.0
+                dx[s] = (1.0 - alpha) * dx[s - 1] + alpha * dx[s]
+                dy[s] = (1.0 - alpha) * dy[s - 1] + alpha * dy[s]
+        out_x[i] = dx[k]
+        out_y[i] = dy[k]
+    return out_x, out_y
+
+
+# Calentamiento: compila la firma al importar el módulo (spline cúbica mínima
+# sobre [0, 1]) para no pagar el JIT en la primera previsualización.
+_t = np.array([0.0, 0.0, 0.0, 0.0, 1.0, 1.0, 1.0, 1.0])
+_c = np.array([0.0, 1.0, 2.0, 3.0])
+deboor_eval(_t, _c, _c, 3, np.linspace(0.0, 1.0, 2))